@@ -1,11 +1,21 @@
+import bisect
+import heapq
+import logging
+import multiprocessing
 import os
 import re
-from typing import List, Dict, Any, Tuple, Set
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Set
 import radon.raw
 import radon.complexity
 
-IGNORE_DIRS = {'.git', 'node_modules', '__pycache__', '.idea', '.vscode', 'venv', 'env', 'dist', 'build', 'coverage'}
-IGNORE_EXTS = {'.png', '.jpg', '.jpeg', '.gif', '.ico', '.svg', '.mp4', '.mov', '.mp3', '.wav', '.pdf', '.zip', '.tar', '.gz', '.pyc'}
+logger = logging.getLogger(__name__)
+
+IGNORE_DIRS = frozenset({'.git', 'node_modules', '__pycache__', '.idea', '.vscode', 'venv', '.venv', 'env', 'dist', 'build', 'coverage', '.pytest_cache', '.mypy_cache'})
+IGNORE_EXTS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.ico', '.svg', '.mp4', '.mov', '.mp3', '.wav', '.pdf', '.zip', '.tar', '.gz', '.pyc'})
 
 # Technology detection patterns
 TECH_PATTERNS: Dict[str, List[str]] = {
@@ -30,6 +40,43 @@ TECH_PATTERNS: Dict[str, List[str]] = {
     "Prisma": ["prisma"],
 }
 
+# Generated or oversized files are not worth parsing and only add noise to scores
+METRICS_MAX_FILE_SIZE = 1_000_000  # bytes
+METRICS_SKIP_FILES = frozenset({'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock', 'composer.lock'})
+METRICS_SKIP_SUFFIXES = ('.min.js', '.min.css', '.map')
+
+# Below this many files the process pool start-up costs more than it saves
+PARALLEL_METRICS_MIN_FILES = 32
+
+# One metrics process pool, created on first use and shared by every request,
+# so concurrent reports don't each start a pool of their own. Workers come from
+# a fork server (spawn where unavailable) rather than fork(): forking the
+# threaded server can leave a child blocked on a lock another thread held.
+METRICS_POOL_MAX_WORKERS = 8
+_metrics_pool: Optional[ProcessPoolExecutor] = None
+_metrics_pool_lock = threading.Lock()
+
+# LRU memo of calculate_metrics keyed by (abs path, mtime_ns, size), so
+# /analyze followed by /report (or repeated reports) only parses files once
+METRICS_CACHE_SIZE = 20000
+_metrics_cache: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+_metrics_cache_lock = threading.Lock()
+
+# Overall score -> letter grade; a score at or above a threshold earns the next label
+GRADE_THRESHOLDS = (40, 50, 55, 60, 65, 70, 75, 80, 85, 90)
+GRADE_LABELS = ("F", "D", "C-", "C", "C+", "B-", "B", "B+", "A-", "A", "A+")
+
+# Aggregate metrics reported when no file has any lines of code
+EMPTY_AGGREGATE_METRICS: Dict[str, Any] = {
+    "readability": 0,
+    "complexity": 0,
+    "maintainability": 0,
+    "docs_coverage": 0,
+    "grade": "N/A",
+    "total_files": 0,
+    "total_loc": 0,
+}
+
 # Secret patterns for static analysis
 SECRET_PATTERNS = [
     (r'(?i)(api[_-]?key|apikey)\s*[=:]\s*["\']?[\w\-]{20,}', "API Key"),
@@ -40,12 +87,55 @@ SECRET_PATTERNS = [
     (r'-----BEGIN (?:RSA |DSA |EC )?PRIVATE KEY-----', "Private Key"),
     (r'(?i)bearer\s+[a-zA-Z0-9\-_.]+', "Bearer Token"),
 ]
+SECRET_REGEXES = [(re.compile(pattern), secret_type) for pattern, secret_type in SECRET_PATTERNS]
+TODO_REGEX = re.compile(r'\b(TODO|FIXME|HACK|XXX)\b', re.IGNORECASE)
+
+def _iter_source_files(root: str) -> Iterator[str]:
+    """
+    Yields analyzable file paths under `root`, skipping IGNORE_DIRS subtrees.
+    Uses the cached dirent type from os.scandir, so no extra stat per entry;
+    symlinks are not followed.
+    """
+    subdirs: List[str] = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORE_DIRS:
+                        subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    _, ext = os.path.splitext(entry.name)
+                    if ext.lower() not in IGNORE_EXTS:
+                        yield entry.path
+    except OSError:
+        return
+
+    for subdir in subdirs:
+        yield from _iter_source_files(subdir)
+
+
+def walk_repo(repo_path: str) -> List[str]:
+    """
+    Lists every analyzable file once, so a report can share one walk across
+    detect_technologies, run_static_analysis, calculate_aggregate_metrics
+    and generate_summary (pass it as `files`).
+    """
+    return list(_iter_source_files(repo_path))
+
 
 def calculate_metrics(file_path: str) -> Dict[str, Any]:
     """
     Calculates LOC, Comment Density, and Complexity for a file.
     """
     try:
+        name = os.path.basename(file_path)
+        if (
+            name in METRICS_SKIP_FILES
+            or name.endswith(METRICS_SKIP_SUFFIXES)
+            or os.path.getsize(file_path) > METRICS_MAX_FILE_SIZE
+        ):
+            return {"loc": 0, "comments": 0, "complexity": 0}
+
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
             content = f.read()
 
@@ -112,12 +202,109 @@ def calculate_metrics(file_path: str) -> Dict[str, Any]:
         return metrics
 
     except Exception as e:
-        print(f"Error calculating metrics for {file_path}: {e}")
+        logger.debug("Error calculating metrics for %s: %s", file_path, e)
         return {"loc": 0, "comments": 0, "complexity": 0}
 
-def analyze_directory_structure(path: str) -> Dict[str, Any]:
+def _metrics_cache_key(file_path: str) -> Optional[Tuple[str, int, int]]:
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+
+
+def calculate_metrics_batch(file_paths: List[str]) -> List[Dict[str, Any]]:
     """
-    Walks the directory structure and returns a JSON tree.
+    Calculates metrics for many files, in the same order as `file_paths`.
+    Unchanged files are served from the metrics cache; the rest are computed.
+    """
+    keys = [_metrics_cache_key(p) for p in file_paths]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+    missing: List[int] = []
+
+    with _metrics_cache_lock:
+        for i, key in enumerate(keys):
+            cached = _metrics_cache.get(key) if key is not None else None
+            if cached is None:
+                missing.append(i)
+            else:
+                _metrics_cache.move_to_end(key)
+                results[i] = cached
+
+    computed = _calculate_metrics_uncached([file_paths[i] for i in missing])
+
+    with _metrics_cache_lock:
+        for i, metrics in zip(missing, computed):
+            results[i] = metrics
+            if keys[i] is not None:
+                _metrics_cache[keys[i]] = metrics
+        while len(_metrics_cache) > METRICS_CACHE_SIZE:
+            _metrics_cache.popitem(last=False)
+
+    return results
+
+
+def _get_metrics_pool() -> ProcessPoolExecutor:
+    global _metrics_pool
+    with _metrics_pool_lock:
+        if _metrics_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                # Warm the fork server with the parser, not the app's __main__
+                context.set_forkserver_preload([__name__])
+            workers = min(os.cpu_count() or 1, METRICS_POOL_MAX_WORKERS)
+            _metrics_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _metrics_pool
+
+
+def _discard_metrics_pool(pool: ProcessPoolExecutor) -> None:
+    global _metrics_pool
+    with _metrics_pool_lock:
+        if _metrics_pool is pool:
+            _metrics_pool = None
+    # Other requests may still be mapping over this pool; let their futures
+    # finish (or fail into their own fallback) rather than cancelling them
+    pool.shutdown(wait=False)
+
+
+def shutdown_metrics_pool() -> None:
+    """Stops the shared metrics pool; the next large batch starts a new one."""
+    global _metrics_pool
+    with _metrics_pool_lock:
+        pool, _metrics_pool = _metrics_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _calculate_metrics_uncached(file_paths: List[str]) -> List[Dict[str, Any]]:
+    """
+    Calculates metrics without consulting the cache.
+    Large batches are spread over the shared process pool since parsing is CPU-bound.
+    """
+    workers = min(os.cpu_count() or 1, METRICS_POOL_MAX_WORKERS)
+    if workers < 2 or len(file_paths) < PARALLEL_METRICS_MIN_FILES:
+        return [calculate_metrics(p) for p in file_paths]
+
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    pool = None
+    try:
+        pool = _get_metrics_pool()
+        return list(pool.map(calculate_metrics, file_paths, chunksize=chunksize))
+    except (BrokenProcessPool, OSError, RuntimeError, CancelledError):
+        # A worker died, processes can't be started here (e.g. sandboxed hosts
+        # without /dev/shm), or the pool was shut down mid-batch (its pending
+        # futures cancelled); the serial path always works. A broken pool is
+        # replaced on the next batch.
+        logger.warning("Metrics process pool unavailable; falling back to serial", exc_info=True)
+        if pool is not None:
+            _discard_metrics_pool(pool)
+        return [calculate_metrics(p) for p in file_paths]
+
+
+def _build_tree(path: str, pending: List[Tuple[Dict[str, Any], str]]) -> Dict[str, Any]:
+    """
+    Builds the folder/file skeleton and queues each file node for metrics.
     """
     name = os.path.basename(path)
     if not name: 
@@ -138,44 +325,63 @@ def analyze_directory_structure(path: str) -> Dict[str, Any]:
                     continue
                 
                 if entry.is_dir():
-                    item["children"].append(analyze_directory_structure(entry.path))
+                    item["children"].append(_build_tree(entry.path, pending))
                 else:
                     _, ext = os.path.splitext(entry.name)
                     if ext.lower() in IGNORE_EXTS:
                         continue
                     
-                    # Calculate metrics for the file
-                    # Note: In a real large repo we might want to do this lazily or async
-                    # For MVP we do it inline
-                    metrics = calculate_metrics(entry.path)
-                    
-                    item["children"].append({
+                    node = {
                         "name": entry.name,
                         "type": "file",
-                        "metrics": metrics
-                    })
+                        "metrics": None
+                    }
+                    item["children"].append(node)
+                    pending.append((node, entry.path))
     except PermissionError:
         pass
 
     return item
 
 
-def detect_technologies(repo_path: str) -> List[str]:
+def analyze_directory_structure(
+    path: str, metrics_by_path: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """
+    Walks the directory structure and returns a JSON tree.
+    If `metrics_by_path` is given, it is filled with each file's metrics so
+    later passes (e.g. calculate_aggregate_metrics) can reuse them.
+    """
+    pending: List[Tuple[Dict[str, Any], str]] = []
+    tree = _build_tree(path, pending)
+
+    metrics_list = calculate_metrics_batch([file_path for _, file_path in pending])
+    for (node, file_path), metrics in zip(pending, metrics_list):
+        node["metrics"] = metrics
+        if metrics_by_path is not None:
+            metrics_by_path[file_path] = metrics
+
+    return tree
+
+
+def detect_technologies(repo_path: str, files: Optional[List[str]] = None) -> List[str]:
     """Detect technologies/frameworks used in the repository."""
     detected: Set[str] = set()
     
+    # Collect every file name in one walk instead of re-walking per pattern
+    if files is None:
+        files = walk_repo(repo_path)
+    file_names: Set[str] = {os.path.basename(p) for p in files}
+    
     # Check for config files
     for tech, patterns in TECH_PATTERNS.items():
         for pattern in patterns:
             if pattern.startswith("*"):
                 # File extension pattern - skip for now, check content below
                 continue
-            # Check if file exists
-            for root, dirs, files in os.walk(repo_path):
-                dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-                if pattern in files:
-                    detected.add(tech)
-                    break
+            if pattern in file_names:
+                detected.add(tech)
+                break
     
     # Check requirements.txt for Python packages
     req_file = os.path.join(repo_path, "requirements.txt")
@@ -224,128 +430,117 @@ def detect_technologies(repo_path: str) -> List[str]:
             pass
     
     # Check for Python files
-    for root, dirs, files in os.walk(repo_path):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        if any(f.endswith('.py') for f in files):
-            detected.add("Python")
-            break
+    if any(name.endswith('.py') for name in file_names):
+        detected.add("Python")
     
     return sorted(list(detected))
 
 
-def run_static_analysis(repo_path: str) -> List[Dict[str, Any]]:
+def run_static_analysis(repo_path: str, files: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """Run static analysis and return list of issues found."""
     issues: List[Dict[str, Any]] = []
+    if files is None:
+        files = walk_repo(repo_path)
     
-    for root, dirs, files in os.walk(repo_path):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        rel_root = os.path.relpath(root, repo_path)
+    for file_path in files:
+        rel_path = os.path.relpath(file_path, repo_path).replace("\\", "/")
         
-        for filename in files:
-            _, ext = os.path.splitext(filename)
-            if ext.lower() in IGNORE_EXTS:
-                continue
-            
-            file_path = os.path.join(root, filename)
-            rel_path = os.path.join(rel_root, filename) if rel_root != "." else filename
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.readlines()
             
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = f.readlines()
-                
-                # Check for secrets
-                for line_num, line in enumerate(lines, 1):
-                    for pattern, secret_type in SECRET_PATTERNS:
-                        if re.search(pattern, line):
-                            issues.append({
-                                "severity": "HIGH",
-                                "title": f"Hardcoded {secret_type} Detected",
-                                "file": rel_path.replace("\\", "/"),
-                                "line": line_num,
-                                "type": "security",
-                            })
-                            break  # One issue per line max
-                
-                # Check Python complexity
-                if filename.endswith('.py'):
-                    content = ''.join(lines)
-                    try:
-                        blocks = radon.complexity.cc_visit(content)
-                        for block in blocks:
-                            if block.complexity > 15:
-                                issues.append({
-                                    "severity": "MEDIUM",
-                                    "title": f"Cyclomatic Complexity > 15 ({block.complexity})",
-                                    "file": rel_path.replace("\\", "/"),
-                                    "line": block.lineno,
-                                    "type": "complexity",
-                                    "function": block.name,
-                                })
-                    except:
-                        pass
-                
-                # Check for TODO/FIXME
-                for line_num, line in enumerate(lines, 1):
-                    if re.search(r'\b(TODO|FIXME|HACK|XXX)\b', line, re.IGNORECASE):
+            # Check for secrets and TODO/FIXME in a single pass over the lines
+            for line_num, line in enumerate(lines, 1):
+                for pattern, secret_type in SECRET_REGEXES:
+                    if pattern.search(line):
                         issues.append({
-                            "severity": "LOW",
-                            "title": "TODO/FIXME Comment",
-                            "file": rel_path.replace("\\", "/"),
+                            "severity": "HIGH",
+                            "title": f"Hardcoded {secret_type} Detected",
+                            "file": rel_path,
                             "line": line_num,
-                            "type": "maintenance",
+                            "type": "security",
                         })
+                        break  # One issue per line max
                 
-            except Exception as e:
-                continue
-    
-    # Sort by severity
+                if TODO_REGEX.search(line):
+                    issues.append({
+                        "severity": "LOW",
+                        "title": "TODO/FIXME Comment",
+                        "file": rel_path,
+                        "line": line_num,
+                        "type": "maintenance",
+                    })
+            
+            # Check Python complexity
+            if file_path.endswith('.py'):
+                content = ''.join(lines)
+                try:
+                    blocks = radon.complexity.cc_visit(content)
+                    for block in blocks:
+                        if block.complexity > 15:
+                            issues.append({
+                                "severity": "MEDIUM",
+                                "title": f"Cyclomatic Complexity > 15 ({block.complexity})",
+                                "file": rel_path,
+                                "line": block.lineno,
+                                "type": "complexity",
+                                "function": block.name,
+                            })
+                except:
+                    pass
+            
+        except Exception as e:
+            continue
+
+    # Keep the 50 most severe issues (stable, same as sorting then slicing)
     severity_order = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
-    issues.sort(key=lambda x: severity_order.get(x["severity"], 3))
-    
-    return issues[:50]  # Limit to 50 issues
+    return heapq.nsmallest(50, issues, key=lambda x: severity_order.get(x["severity"], 3))
+
+
+def score_to_grade(score: float) -> str:
+    """Map a 0-100 score to a letter grade."""
+    return GRADE_LABELS[bisect.bisect_right(GRADE_THRESHOLDS, score)]
 
 
-def calculate_aggregate_metrics(repo_path: str) -> Dict[str, Any]:
-    """Calculate aggregate quality metrics for the entire repository."""
+def calculate_aggregate_metrics(
+    repo_path: str,
+    known_metrics: Optional[Dict[str, Dict[str, Any]]] = None,
+    files: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Calculate aggregate quality metrics for the entire repository.
+    Files already measured in `known_metrics` are not measured again.
+    """
+    file_paths = files if files is not None else walk_repo(repo_path)
+    if not known_metrics:
+        return _aggregate_from_metrics(calculate_metrics_batch(file_paths))
+
+    missing = [p for p in file_paths if p not in known_metrics]
+    computed = dict(zip(missing, calculate_metrics_batch(missing)))
+    return _aggregate_from_metrics(
+        known_metrics[p] if p in known_metrics else computed[p] for p in file_paths
+    )
+
+
+def _aggregate_from_metrics(metrics_iter: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
     total_loc = 0
     total_comments = 0
     total_complexity = 0
     file_count = 0
     high_complexity_count = 0
     
-    all_complexities = []
-    
-    for root, dirs, files in os.walk(repo_path):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        
-        for filename in files:
-            _, ext = os.path.splitext(filename)
-            if ext.lower() in IGNORE_EXTS:
-                continue
-            
-            file_path = os.path.join(root, filename)
-            metrics = calculate_metrics(file_path)
+    for metrics in metrics_iter:
+        if metrics["loc"] > 0:
+            file_count += 1
+            total_loc += metrics["loc"]
+            total_comments += metrics["comments"]
+            total_complexity += metrics["complexity"]
             
-            if metrics["loc"] > 0:
-                file_count += 1
-                total_loc += metrics["loc"]
-                total_comments += metrics["comments"]
-                total_complexity += metrics["complexity"]
-                all_complexities.append(metrics["complexity"])
-                
-                if metrics["complexity"] > 10:
-                    high_complexity_count += 1
+            if metrics["complexity"] > 10:
+                high_complexity_count += 1
     
     if file_count == 0:
-        return {
-            "readability": 0,
-            "complexity": 0,
-            "maintainability": 0,
-            "docs_coverage": 0,
-            "grade": "N/A",
-            "total_files": 0,
-            "total_loc": 0,
-        }
+        return dict(EMPTY_AGGREGATE_METRICS)
     
     # Calculate scores (0-100)
     avg_complexity = total_complexity / file_count if file_count else 0
@@ -366,28 +561,7 @@ def calculate_aggregate_metrics(repo_path: str) -> Dict[str, Any]:
     # Overall grade
     overall_score = (readability + complexity_score + maintainability + docs_coverage) / 4
     
-    if overall_score >= 90:
-        grade = "A+"
-    elif overall_score >= 85:
-        grade = "A"
-    elif overall_score >= 80:
-        grade = "A-"
-    elif overall_score >= 75:
-        grade = "B+"
-    elif overall_score >= 70:
-        grade = "B"
-    elif overall_score >= 65:
-        grade = "B-"
-    elif overall_score >= 60:
-        grade = "C+"
-    elif overall_score >= 55:
-        grade = "C"
-    elif overall_score >= 50:
-        grade = "C-"
-    elif overall_score >= 40:
-        grade = "D"
-    else:
-        grade = "F"
+    grade = score_to_grade(overall_score)
     
     return {
         "readability": round(readability),
@@ -400,22 +574,22 @@ def calculate_aggregate_metrics(repo_path: str) -> Dict[str, Any]:
     }
 
 
-def generate_summary(repo_path: str, technologies: List[str]) -> str:
+def generate_summary(repo_path: str, technologies: List[str], files: Optional[List[str]] = None) -> str:
     """Generate a brief summary description of the repository."""
     # Count files by type
     py_files = 0
     js_files = 0
     ts_files = 0
     
-    for root, dirs, files in os.walk(repo_path):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        for f in files:
-            if f.endswith('.py'):
-                py_files += 1
-            elif f.endswith('.js') or f.endswith('.jsx'):
-                js_files += 1
-            elif f.endswith('.ts') or f.endswith('.tsx'):
-                ts_files += 1
+    if files is None:
+        files = walk_repo(repo_path)
+    for f in files:
+        if f.endswith('.py'):
+            py_files += 1
+        elif f.endswith('.js') or f.endswith('.jsx'):
+            js_files += 1
+        elif f.endswith('.ts') or f.endswith('.tsx'):
+            ts_files += 1
     
     parts = []
     
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# SQLite caps bound parameters per statement; stay well below the limit
+_LOOKUP_CHUNK = 500
+
+# Vectors are stored as fp16, the precision the FAISS index keeps them at
+# anyway, so the cache is half the size of float32 at no retrieval cost.
+# The table name carries the dtype; an older float32 table is dropped.
+_TABLE = "embeddings_f16"
+_LEGACY_TABLES = ("embeddings",)
+
+
+def _encode(vector: List[float]) -> bytes:
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a persistent SQLite cache keyed by
+    sha256(model + NUL + text), so re-indexing only embeds new or changed chunks.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, db_path: str):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.db_path = db_path
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            # WAL lets concurrent /index calls read while another one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            for table in _LEGACY_TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {_TABLE} (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+
+        with closing(self._connect()) as conn:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), _LOOKUP_CHUNK):
+                batch = unique_keys[i:i + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM {_TABLE} WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = _decode(blob)
+
+            # Embed each distinct missing text once
+            missing: Dict[str, str] = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+
+            if missing:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+                rows = []
+                for key, vector in zip(missing, vectors):
+                    blob = _encode(vector)
+                    # Return what the cache will return next time, so a first
+                    # index and a re-index produce identical vectors
+                    found[key] = _decode(blob)
+                    rows.append((key, blob))
+                conn.executemany(f"INSERT OR REPLACE INTO {_TABLE} (key, vector) VALUES (?, ?)", rows)
+                conn.commit()
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries are one-off; caching them would only grow the table
+        return self.underlying.embed_query(text)
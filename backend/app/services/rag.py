@@ -1,17 +1,33 @@
+import asyncio
+import bisect
+import heapq
 import json
+import math
 import os
+import re
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
+import faiss
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough, Runnable
 from langchain_core.output_parsers import StrOutputParser
 
 from app.core.config import settings
 from app.core.security import redact_secrets
+from app.services.embedding_cache import CachedEmbeddings
 
 # High value files to index
 HIGH_VALUE_EXTENSIONS = {
@@ -19,6 +35,10 @@ HIGH_VALUE_EXTENSIONS = {
     '.json', '.html', '.css', '.java', '.go', '.rs', '.c', '.cpp'
 }
 HIGH_VALUE_NAMES = {'Dockerfile', 'Makefile', 'Requirements.txt', 'package.json'}
+_HIGH_VALUE_SUFFIXES = tuple(sorted(HIGH_VALUE_EXTENSIONS))
+
+# Path fragments never indexed; matching directories are pruned from the walk
+SKIP_FRAGMENTS = ('.git', 'node_modules', '__pycache__', 'venv')
 
 # Persist indexes at the project root (stable regardless of CWD)
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
@@ -27,202 +47,569 @@ FAISS_ROOT = str(PROJECT_ROOT / "faiss_indexes")
 # Fallback (non-vector) index for keyword retrieval
 FALLBACK_ROOT = str(PROJECT_ROOT / "fallback_indexes")
 
+# Keyword retrieval: BM25 over lowercase alphanumeric tokens of 3+ characters.
+# Identifiers are indexed whole and by their camelCase/PascalCase parts, and
+# query tokens also match as prefixes, so "user" finds getUserById and
+# "depend" finds dependency.
+TOKEN_REGEX = re.compile(r"[A-Za-z0-9]+")
+CAMEL_PART_REGEX = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Chunk embeddings persist across re-indexes so unchanged chunks are not re-sent
+EMBEDDING_MODEL = "models/embedding-001"
+EMBEDDING_CACHE_PATH = str(PROJECT_ROOT / "embedding_cache" / "embeddings.sqlite3")
+
+# Embedding requests: Gemini accepts up to 100 texts per call; a few calls
+# run concurrently so indexing is not one round-trip after another
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 4
+EMBED_RETRIES = 2
+
+# Vector index: flat (exact) up to HNSW_MIN_VECTORS chunks, HNSW beyond;
+# either way vectors are stored as fp16, which barely moves top-5 results
+VECTOR_QUANTIZATION = "fp16"
+HNSW_MIN_VECTORS = 5000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 64
+
+# Chunking: code is split on language-aware boundaries (classes, functions,
+# headings) so chunks stay coherent; other files use the generic separators
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+LANGUAGE_BY_EXT = {
+    '.py': Language.PYTHON,
+    '.js': Language.JS, '.jsx': Language.JS,
+    '.ts': Language.TS, '.tsx': Language.TS,
+    '.md': Language.MARKDOWN,
+    '.html': Language.HTML,
+    '.java': Language.JAVA,
+    '.go': Language.GO,
+    '.rs': Language.RUST,
+    '.c': Language.C,
+    '.cpp': Language.CPP,
+}
+_DEFAULT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+_SPLITTERS_BY_EXT = {
+    ext: RecursiveCharacterTextSplitter.from_language(lang, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    for ext, lang in LANGUAGE_BY_EXT.items()
+}
+
+# Worker threads for reading and redacting files before chunking
+LOAD_CONCURRENCY = 16
+
+# Chat model settings
+CHAT_MODEL = "gemini-2.5-flash"
+CHAT_TEMPERATURE = 0.2
+
+# Chat prompt, parsed once at import and shared by every chain
+CHAT_TEMPLATE = """You are an expert developer explaining a codebase.
+Answer the question based ONLY on the following context.
+Cite filenames when referring to code.
+If you don't know the answer, say "I couldn't find that in the codebase."
+
+Context:
+{context}
+
+Question: {question}
+"""
+CHAT_PROMPT = ChatPromptTemplate.from_template(CHAT_TEMPLATE)
+
+# LRU of chat answers keyed by (repo_id, normalized question). Chat is
+# stateless, so the same question against the same index gets the same context.
+ANSWER_CACHE_SIZE = 512
+_answer_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+# In-flight answers per (cache key, index generation). Only touched from the
+# event loop, so it needs no lock.
+_answers_in_flight: "Dict[Tuple[Tuple[str, str], int], asyncio.Future]" = {}
+
+# Built chat chains per repo, so the FAISS index / keyword index is loaded
+# once rather than on every /chat. The generation counter stops a build that
+# raced with a re-index from caching a chain over the old index.
+_chain_cache: Dict[str, Runnable] = {}
+_chain_generation: Dict[str, int] = {}
+_chain_cache_lock = threading.Lock()
+
 
 def _repo_fallback_path(repo_id: str) -> str:
     return os.path.join(FALLBACK_ROOT, repo_id, "chunks.jsonl")
 
 
+def _repo_keyword_index_path(repo_id: str) -> str:
+    return os.path.join(FALLBACK_ROOT, repo_id, "bm25.json")
+
+
+def _tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for run in TOKEN_REGEX.findall(text):
+        if len(run) >= 3:
+            tokens.append(run.lower())
+        if not run.islower():
+            parts = CAMEL_PART_REGEX.findall(run)
+            if len(parts) > 1:
+                tokens.extend(p.lower() for p in parts if len(p) >= 3)
+    return tokens
+
+
+def _build_keyword_index(contents: List[str]) -> dict:
+    """
+    Builds a BM25 inverted index. Postings are stored column-wise per token as
+    (chunk ids, term frequencies) in two array('I'), far smaller than a list
+    of [id, tf] pairs.
+    """
+    postings: Dict[str, Tuple[array, array]] = {}
+    doc_lens: List[int] = []
+    for chunk_id, content in enumerate(contents):
+        tokens = _tokenize(content or "")
+        doc_lens.append(len(tokens))
+        for tok, tf in Counter(tokens).items():
+            plist = postings.get(tok)
+            if plist is None:
+                plist = postings[tok] = (array("I"), array("I"))
+            plist[0].append(chunk_id)
+            plist[1].append(tf)
+
+    avg_len = (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0
+    return {
+        "doc_lens": array("I", doc_lens),
+        "avg_len": avg_len,
+        "postings": postings,
+        "vocab": sorted(postings),
+    }
+
+
+def _keyword_index_to_json(keyword_index: dict) -> dict:
+    payload = {k: v for k, v in keyword_index.items() if k != "vocab"}
+    payload["doc_lens"] = keyword_index["doc_lens"].tolist()
+    payload["offsets"] = keyword_index["offsets"].tolist()
+    payload["postings"] = {
+        tok: {"ids": ids.tolist(), "tfs": tfs.tolist()} for tok, (ids, tfs) in keyword_index["postings"].items()
+    }
+    return payload
+
+
+def _keyword_index_from_json(payload: dict) -> dict:
+    # Raises KeyError/TypeError on bm25.json files from older layouts
+    postings = {
+        tok: (array("I", plist["ids"]), array("I", plist["tfs"])) for tok, plist in payload["postings"].items()
+    }
+    payload["postings"] = postings
+    payload["vocab"] = sorted(postings)
+    payload["doc_lens"] = array("I", payload["doc_lens"])
+    payload["offsets"] = array("Q", payload["offsets"])
+    return payload
+
+
+def _file_identity(st: os.stat_result) -> List[int]:
+    # Identifies one version of chunks.jsonl; os.replace swaps in a new inode
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+
 def _write_fallback_chunks(repo_id: str, splits) -> None:
-    os.makedirs(os.path.join(FALLBACK_ROOT, repo_id), exist_ok=True)
-    path = _repo_fallback_path(repo_id)
-    with open(path, "w", encoding="utf-8") as f:
+    repo_dir = os.path.join(FALLBACK_ROOT, repo_id)
+    os.makedirs(repo_dir, exist_ok=True)
+
+    # Both files are written under temp names and swapped in with os.replace,
+    # so readers never see a half-written file
+    offsets = array("Q")
+    fd, chunks_tmp = tempfile.mkstemp(dir=repo_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
         for doc in splits:
             payload = {
                 "source": doc.metadata.get("source", "unknown"),
                 "content": doc.page_content,
             }
-            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            offsets.append(f.tell())
+            f.write((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+        f.flush()
+        chunks_file = _file_identity(os.fstat(f.fileno()))
 
+    # Tokenize once here so queries only probe postings for their own tokens;
+    # byte offsets let retrieval read just the top-k chunks back from disk
+    keyword_index = _build_keyword_index([doc.page_content for doc in splits])
+    keyword_index["offsets"] = offsets
+    keyword_index["chunks_file"] = chunks_file
+    fd, index_tmp = tempfile.mkstemp(dir=repo_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(_keyword_index_to_json(keyword_index), f, ensure_ascii=False)
 
-def _load_fallback_chunks(repo_id: str) -> List[dict]:
-    path = _repo_fallback_path(repo_id)
-    if not os.path.exists(path):
-        return []
-    chunks: List[dict] = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
+    os.replace(chunks_tmp, _repo_fallback_path(repo_id))
+    os.replace(index_tmp, _repo_keyword_index_path(repo_id))
+
+
+def _scan_fallback_chunks(repo_id: str) -> dict:
+    """
+    Reads every chunk with its byte offset and rebuilds the keyword index;
+    only needed when bm25.json is missing or does not match chunks.jsonl.
+    """
+    offsets = array("Q")
+    contents: List[str] = []
+    with open(_repo_fallback_path(repo_id), "rb") as f:
+        chunks_file = _file_identity(os.fstat(f.fileno()))
+        while True:
+            offset = f.tell()
+            line = f.readline()
             if not line:
+                break
+            if not line.strip():
                 continue
             try:
-                chunks.append(json.loads(line))
+                chunk = json.loads(line)
             except Exception:
                 continue
+            offsets.append(offset)
+            contents.append(chunk.get("content") or "")
+
+    keyword_index = _build_keyword_index(contents)
+    keyword_index["offsets"] = offsets
+    keyword_index["chunks_file"] = chunks_file
+    return keyword_index
+
+
+def _load_keyword_index(repo_id: str) -> Optional[dict]:
+    try:
+        chunks_file = _file_identity(os.stat(_repo_fallback_path(repo_id)))
+    except OSError:
+        return None
+    try:
+        with open(_repo_keyword_index_path(repo_id), "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("chunks_file") == chunks_file:
+            return _keyword_index_from_json(payload)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    # Indexed before bm25.json recorded its chunks file or used column-wise
+    # postings, or caught between the two replaces of a re-index: rebuild in
+    # memory from the current file
+    try:
+        return _scan_fallback_chunks(repo_id)
+    except OSError:
+        return None
+
+
+def _read_fallback_chunks(repo_id: str, keyword_index: dict, chunk_ids: List[int]) -> Optional[List[dict]]:
+    """
+    Reads the given chunks by offset. Returns None if chunks.jsonl is no longer
+    the file the offsets were taken from (the repo was re-indexed).
+    """
+    offsets = keyword_index["offsets"]
+    chunks: List[dict] = []
+    try:
+        with open(_repo_fallback_path(repo_id), "rb") as f:
+            if _file_identity(os.fstat(f.fileno())) != keyword_index.get("chunks_file"):
+                return None
+            for chunk_id in chunk_ids:
+                f.seek(offsets[chunk_id])
+                try:
+                    chunks.append(json.loads(f.readline()))
+                except Exception:
+                    continue
+    except OSError:
+        return None
     return chunks
 
 
-def _keyword_retrieve(chunks: List[dict], query: str, k: int = 5) -> List[dict]:
-    # Very simple scoring: token overlap; fast and dependency-free.
-    q = (query or "").lower()
-    q_tokens = {t for t in q.replace("/", " ").replace("_", " ").split() if len(t) >= 3}
+def _keyword_retrieve(keyword_index: dict, query: str, k: int = 5) -> List[int]:
+    # BM25 over the inverted index; only postings of the query tokens are visited.
+    # Returns chunk ids, best first.
+    doc_lens = keyword_index["doc_lens"]
+    n_docs = len(doc_lens)
+    q_tokens = set(_tokenize(query or ""))
     if not q_tokens:
-        return chunks[:k]
+        return list(range(min(k, n_docs)))
+
+    postings = keyword_index["postings"]
+    vocab = keyword_index["vocab"]
+    avg_len = keyword_index["avg_len"] or 1.0
+
+    # Each query token matches every indexed token it is a prefix of
+    terms: Set[str] = set()
+    for tok in q_tokens:
+        i = bisect.bisect_left(vocab, tok)
+        while i < len(vocab) and vocab[i].startswith(tok):
+            terms.add(vocab[i])
+            i += 1
+
+    scores: Dict[int, float] = {}
+    for term in terms:
+        ids, tfs = postings[term]
+        idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+        for chunk_id, tf in zip(ids, tfs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[chunk_id] / avg_len)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+    return [chunk_id for chunk_id, _ in top]
+
+def _answer_cache_key(repo_id: str, question: str) -> Tuple[str, str]:
+    return (repo_id, " ".join((question or "").split()))
 
-    scored = []
-    for ch in chunks:
-        text = (ch.get("content") or "").lower()
-        score = 0
-        for tok in q_tokens:
-            if tok in text:
-                score += 1
-        if score:
-            scored.append((score, ch))
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [c for _, c in scored[:k]]
+def invalidate_repo_cache(repo_id: str) -> None:
+    """
+    Drops the cached chat chain and answers for a repo. Call whenever its
+    index is rebuilt or the repo is removed, so stale retrieval is never served.
+    """
+    with _chain_cache_lock:
+        _chain_cache.pop(repo_id, None)
+        _chain_generation[repo_id] = _chain_generation.get(repo_id, 0) + 1
+    with _answer_cache_lock:
+        for key in [k for k in _answer_cache if k[0] == repo_id]:
+            del _answer_cache[key]
 
 def get_embeddings():
     if not settings.GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY is not set.")
-    return GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=settings.GOOGLE_API_KEY)
+    return _get_embeddings(settings.GOOGLE_API_KEY)
+
+
+# Clients are built once and shared; keyed on the API key so a changed
+# setting still takes effect
+@lru_cache(maxsize=1)
+def _get_embeddings(api_key: str) -> GoogleGenerativeAIEmbeddings:
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key)
+
+
+@lru_cache(maxsize=4)
+def _get_llm(api_key: str, model: str = CHAT_MODEL, temperature: float = CHAT_TEMPERATURE) -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(model=model, temperature=temperature, google_api_key=api_key)
+
+def _embed_batch(embeddings, texts: List[str]) -> List[List[float]]:
+    # Retry a failed batch on its own so one error doesn't re-embed everything
+    for attempt in range(EMBED_RETRIES + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception:
+            if attempt == EMBED_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def _embed_in_batches(embeddings, texts: List[str]) -> List[List[float]]:
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+        results = executor.map(lambda batch: _embed_batch(embeddings, batch), batches)
+        return [vector for batch_vectors in results for vector in batch_vectors]
 
 def is_high_value_file(file_path: str) -> bool:
     name = os.path.basename(file_path)
-    _, ext = os.path.splitext(name)
-    return name in HIGH_VALUE_NAMES or ext.lower() in HIGH_VALUE_EXTENSIONS
+    return name in HIGH_VALUE_NAMES or name.lower().endswith(_HIGH_VALUE_SUFFIXES)
+
+def _splitter_for(source: str) -> RecursiveCharacterTextSplitter:
+    _, ext = os.path.splitext(source)
+    return _SPLITTERS_BY_EXT.get(ext.lower(), _DEFAULT_SPLITTER)
+
+
+def _load_one(file_path: str, repo_path: str, repo_id: str) -> List[Document]:
+    try:
+        loader = TextLoader(file_path, encoding='utf-8', autodetect_encoding=True)
+        docs = loader.load()
+    except Exception:
+        # Skip files that fail to load
+        return []
+
+    for doc in docs:
+        # 2. Redact
+        doc.page_content = redact_secrets(doc.page_content)
+        # Add metadata
+        doc.metadata["source"] = os.path.relpath(file_path, repo_path)
+        doc.metadata["repo_id"] = repo_id
+    return docs
+
+
+def _new_faiss_index(dim: int, n_vectors: int):
+    # Vectors are stored as fp16 (half the RAM and disk of float32). Exact
+    # search is cheap for small repos; past that, HNSW keeps chat-time
+    # retrieval roughly logarithmic in the number of chunks
+    if n_vectors <= HNSW_MIN_VECTORS:
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
 
 def index_repository(repo_path: str, repo_id: str):
     """
     Indexes the repository into FAISS.
     """
-    documents = []
-    
-    # 1. Walk and Load
-    for root, _, files in os.walk(repo_path):
+    # 1. Walk, then load candidates concurrently (reads and redaction are I/O-bound)
+    candidate_paths = []
+    for root, dirs, files in os.walk(repo_path):
+        # Prune skipped subtrees so they are never descended into
+        dirs[:] = [d for d in dirs if not any(p in d for p in SKIP_FRAGMENTS)]
         for file in files:
-            file_path = os.path.join(root, file)
-            
-            # Simple filter
-            if any(p in file_path for p in ['.git', 'node_modules', '__pycache__', 'venv']):
+            if any(p in file for p in SKIP_FRAGMENTS):
                 continue
 
-            if is_high_value_file(file_path):
-                try:
-                    loader = TextLoader(file_path, encoding='utf-8', autodetect_encoding=True)
-                    docs = loader.load()
-                    
-                    for doc in docs:
-                        # 2. Redact
-                        doc.page_content = redact_secrets(doc.page_content)
-                        # Add metadata
-                        doc.metadata["source"] = os.path.relpath(file_path, repo_path)
-                        doc.metadata["repo_id"] = repo_id
-                        
-                    documents.extend(docs)
-                except Exception as e:
-                    # Skip files that fail to load
-                    pass
+            if is_high_value_file(file):
+                candidate_paths.append(os.path.join(root, file))
+
+    documents: List[Document] = []
+    with ThreadPoolExecutor(max_workers=LOAD_CONCURRENCY) as executor:
+        for docs in executor.map(lambda path: _load_one(path, repo_path, repo_id), candidate_paths):
+            documents.extend(docs)
 
     if not documents:
         return {"indexed": False, "reason": "No indexable documents found."}
 
     # 3. Chunk
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents(documents)
+    splits = []
+    for doc in documents:
+        splits.extend(_splitter_for(doc.metadata["source"]).split_documents([doc]))
 
     # Always write fallback chunks so chat can still work without FAISS/embeddings.
     _write_fallback_chunks(repo_id, splits)
+    # Chains built on the previous chunk files must not outlive the rewrite;
+    # the embedding run below can take minutes
+    invalidate_repo_cache(repo_id)
 
     # 4. Upsert to FAISS
     # For FAISS, we typically create a new index for the repo or load existing one
     # Try to build FAISS vector index (optional).
     try:
         embeddings = get_embeddings()
-        vectorstore = FAISS.from_documents(splits, embeddings)
+        cached_embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, EMBEDDING_CACHE_PATH)
+        texts = [doc.page_content for doc in splits]
+        vectors = _embed_in_batches(cached_embeddings, texts)
+        vectorstore = FAISS(embeddings, _new_faiss_index(len(vectors[0]), len(vectors)), InMemoryDocstore(), {})
+        vectorstore.add_embeddings(
+            list(zip(texts, vectors)),
+            metadatas=[doc.metadata for doc in splits],
+        )
 
         index_path = os.path.join(FAISS_ROOT, repo_id)
         os.makedirs(index_path, exist_ok=True)
         vectorstore.save_local(index_path)
-        return {"indexed": True, "vector": True}
+        result = {"indexed": True, "vector": True, "quantization": VECTOR_QUANTIZATION}
     except Exception as e:
         # Fallback chunks already written.
-        return {"indexed": True, "vector": False, "warning": str(e)}
+        result = {"indexed": True, "vector": False, "warning": str(e)}
+
+    # Chains and answers cached against the previous index are stale now
+    invalidate_repo_cache(repo_id)
+    return result
+
+def _format_docs(docs) -> str:
+    return "\n\n".join(f"Filename: {d.metadata.get('source', 'unknown')}\nContent:\n{d.page_content}" for d in docs)
+
+
+def _format_fallback(docs) -> str:
+    return "\n\n".join(
+        f"Filename: {d.get('source', 'unknown')}\nContent:\n{d.get('content', '')}" for d in docs
+    )
+
+
+def _repo_generation(repo_id: str) -> int:
+    with _chain_cache_lock:
+        return _chain_generation.get(repo_id, 0)
+
 
 def get_chat_chain(repo_id: str) -> Runnable:
     """
-    Returns a RAG chain for a specific repository.
+    Returns a RAG chain for a specific repository, building it on first use.
     """
     if not settings.GOOGLE_API_KEY:
          raise ValueError("GOOGLE_API_KEY is not set.")
 
+    with _chain_cache_lock:
+        chain = _chain_cache.get(repo_id)
+        generation = _chain_generation.get(repo_id, 0)
+    if chain is not None:
+        return chain
+
+    chain = _build_chat_chain(repo_id)
+
+    with _chain_cache_lock:
+        if _chain_generation.get(repo_id, 0) == generation:
+            _chain_cache[repo_id] = chain
+    return chain
+
+
+def _build_chat_chain(repo_id: str) -> Runnable:
     index_path = os.path.join(FAISS_ROOT, repo_id)
-    fallback_chunks = _load_fallback_chunks(repo_id)
+    has_vector_index = os.path.exists(index_path)
+    # The keyword index is only needed when there is no vector index
+    keyword_index = None if has_vector_index else _load_keyword_index(repo_id)
 
-    retriever = None
-    if os.path.exists(index_path):
+    if has_vector_index:
         embeddings = get_embeddings()
         vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
         retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-    elif fallback_chunks:
+        context = retriever | _format_docs
+    elif keyword_index and keyword_index["doc_lens"]:
         # Use keyword retrieval from on-disk chunks.
-        def _fallback_retrieve(question: str):
-            return _keyword_retrieve(fallback_chunks, question, k=5)
-
-        def format_fallback(docs):
-            return "\n\n".join(
-                f"Filename: {d.get('source', 'unknown')}\nContent:\n{d.get('content', '')}" for d in docs
-            )
+        current = [keyword_index]
 
-        template = """You are an expert developer explaining a codebase.
-Answer the question based ONLY on the following context.
-Cite filenames when referring to code.
-If you don't know the answer, say \"I couldn't find that in the codebase.\"\n\nContext:\n{context}\n\nQuestion: {question}\n"""
-        prompt = ChatPromptTemplate.from_template(template)
-
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            temperature=0.2,
-            google_api_key=settings.GOOGLE_API_KEY,
-        )
-
-        chain = (
-            {"context": RunnablePassthrough() | _fallback_retrieve | format_fallback, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-        return chain
+        def _fallback_retrieve(question: str):
+            chunks = _read_fallback_chunks(repo_id, current[0], _keyword_retrieve(current[0], question, k=5))
+            if chunks is None:
+                # chunks.jsonl was replaced under this chain; reload its index once
+                reloaded = _load_keyword_index(repo_id)
+                if reloaded is None:
+                    return []
+                current[0] = reloaded
+                chunks = _read_fallback_chunks(repo_id, reloaded, _keyword_retrieve(reloaded, question, k=5))
+            return chunks or []
+
+        context = RunnablePassthrough() | _fallback_retrieve | _format_fallback
     else:
         raise ValueError(
             f"Index for repo {repo_id} not found. Run /index/{repo_id} first (or ensure indexing succeeds)."
         )
     
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0.2,
-        google_api_key=settings.GOOGLE_API_KEY
-    )
-    
-    template = """You are an expert developer explaining a codebase. 
-    Answer the question based ONLY on the following context. 
-    Cite filenames when referring to code.
-    If you don't know the answer, say "I couldn't find that in the codebase."
-    
-    Context:
-    {context}
-    
-    Question: {question}
-    """
-    prompt = ChatPromptTemplate.from_template(template)
-
-    def format_docs(docs):
-        return "\n\n".join(f"Filename: {d.metadata.get('source', 'unknown')}\nContent:\n{d.page_content}" for d in docs)
+    llm = _get_llm(settings.GOOGLE_API_KEY)
 
     chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
+        {"context": context, "question": RunnablePassthrough()}
+        | CHAT_PROMPT
         | llm
         | StrOutputParser()
     )
     
     return chain
+
+
+async def answer_question(repo_id: str, question: str) -> str:
+    """
+    Answers a chat question, reusing the cached answer for repeated questions.
+    Concurrent identical questions share one in-flight answer, so a burst of
+    them makes a single LLM call.
+    """
+    key = _answer_cache_key(repo_id, question)
+    with _answer_cache_lock:
+        cached = _answer_cache.get(key)
+        if cached is not None:
+            _answer_cache.move_to_end(key)
+            return cached
+
+    # Keyed by generation too, so a question asked after a re-index never
+    # joins an answer that is being built from the old index
+    generation = _repo_generation(repo_id)
+    flight_key = (key, generation)
+    task = _answers_in_flight.get(flight_key)
+    if task is None:
+        task = asyncio.ensure_future(_compute_answer(repo_id, question, key, generation))
+        _answers_in_flight[flight_key] = task
+        task.add_done_callback(lambda _: _answers_in_flight.pop(flight_key, None))
+    # Shielded: one caller going away must not cancel the answer for the others
+    return await asyncio.shield(task)
+
+
+async def _compute_answer(repo_id: str, question: str, key: Tuple[str, str], generation: int) -> str:
+    # Chain setup reads indexes from disk, so it runs in a worker thread; the
+    # LLM call itself is awaited so the event loop stays free meanwhile.
+    chain = await asyncio.to_thread(get_chat_chain, repo_id)
+    answer = await chain.ainvoke(question)
+
+    with _answer_cache_lock:
+        # Only cache if the index was not rebuilt while we answered. Checked
+        # under the answer lock, so an invalidation that bumps the generation
+        # after this check still clears the entry stored here.
+        if _repo_generation(repo_id) == generation:
+            _answer_cache[key] = answer
+            while len(_answer_cache) > ANSWER_CACHE_SIZE:
+                _answer_cache.popitem(last=False)
+    return answer
@@ -1,12 +1,15 @@
+import asyncio
+import logging
 import os
 import shutil
-import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from functools import partial
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Any, Callable, Dict, Optional
 
 from app.core.config import settings
 from app.services.cloner import clone_repository
@@ -16,44 +19,81 @@ from app.services.analyzer import (
     run_static_analysis,
     calculate_aggregate_metrics,
     generate_summary,
+    shutdown_metrics_pool,
+    walk_repo,
 )
-from app.services.rag import index_repository, get_chat_chain
+from app.services.rag import index_repository, answer_question, invalidate_repo_cache
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # Auto-cleanup: track repo last-access time and delete after TTL (1 hour)
 # ---------------------------------------------------------------------------
 REPO_TTL_SECONDS = 60 * 60  # 1 hour
+# Every access is a single dict operation (store, pop, clear, or an items()
+# snapshot), each atomic under the GIL, so the per-request touch takes no lock.
 repo_access_times: Dict[str, float] = {}
-_cleanup_lock = threading.Lock()
+
+# Finished /report payloads per repo. Clones get a fresh id and are never
+# modified, so an entry stays valid until the clone is deleted or expires.
+_report_cache: Dict[str, Dict[str, Any]] = {}
+
+# Clones, analyses and indexing block for seconds at a time. They run on their
+# own pool so a burst of them cannot exhaust the threadpool FastAPI uses for
+# everything else, and async handlers keep the event loop free meanwhile.
+# Created on first use (only ever from the event loop) and shut down in lifespan.
+REPO_WORK_THREADS = 8
+_repo_work_executor: Optional[ThreadPoolExecutor] = None
 
 
 def _touch_repo(repo_id: str) -> None:
     """Update last-access timestamp for a repo."""
-    with _cleanup_lock:
-        repo_access_times[repo_id] = time.time()
+    repo_access_times[repo_id] = time.time()
+
+
+async def _run_repo_work(func: Callable[..., Any], *args: Any) -> Any:
+    """Run blocking repo work (clone, analysis, indexing) on the dedicated pool."""
+    global _repo_work_executor
+    if _repo_work_executor is None:
+        _repo_work_executor = ThreadPoolExecutor(max_workers=REPO_WORK_THREADS, thread_name_prefix="repo-work")
+    return await asyncio.get_running_loop().run_in_executor(_repo_work_executor, func, *args)
+
+
+def _require_repo(repo_id: str) -> str:
+    """Return the clone path for a repo (404 if missing) and refresh its TTL."""
+    repo_path = os.path.join(settings.TEMP_DIR, repo_id)
+    if not os.path.isdir(repo_path):
+        raise HTTPException(status_code=404, detail="Repository not found")
+    _touch_repo(repo_id)
+    return repo_path
 
 
 def _cleanup_expired_repos() -> None:
     """Delete repos that haven't been accessed within TTL."""
     now = time.time()
-    with _cleanup_lock:
-        expired = [rid for rid, ts in repo_access_times.items() if now - ts > REPO_TTL_SECONDS]
+    expired = [rid for rid, ts in list(repo_access_times.items()) if now - ts > REPO_TTL_SECONDS]
     for rid in expired:
+        # Skip repos that were used again since the snapshot
+        ts = repo_access_times.get(rid)
+        if ts is not None and time.time() - ts <= REPO_TTL_SECONDS:
+            continue
         repo_path = os.path.join(settings.TEMP_DIR, rid)
         if os.path.exists(repo_path):
             shutil.rmtree(repo_path, ignore_errors=True)
-        with _cleanup_lock:
-            repo_access_times.pop(rid, None)
+        invalidate_repo_cache(rid)
+        _report_cache.pop(rid, None)
+        repo_access_times.pop(rid, None)
 
 
-def _cleanup_loop(stop_event: threading.Event) -> None:
-    """Background thread that runs cleanup every 5 minutes."""
-    while not stop_event.wait(300):
-        _cleanup_expired_repos()
-
-
-_cleanup_stop = threading.Event()
-_cleanup_thread: Optional[threading.Thread] = None
+async def _cleanup_loop() -> None:
+    """Background task that runs cleanup every 5 minutes."""
+    while True:
+        await asyncio.sleep(300)
+        try:
+            # rmtree blocks, so keep it off the event loop
+            await asyncio.to_thread(_cleanup_expired_repos)
+        except Exception:
+            logger.exception("Repo cleanup failed")
 
 
 def _cleanup_all_repos() -> None:
@@ -63,20 +103,29 @@ def _cleanup_all_repos() -> None:
             entry_path = os.path.join(settings.TEMP_DIR, entry)
             if os.path.isdir(entry_path):
                 shutil.rmtree(entry_path, ignore_errors=True)
-    with _cleanup_lock:
-        repo_access_times.clear()
+    _report_cache.clear()
+    repo_access_times.clear()
+
+
+def _shutdown_repo_work() -> None:
+    """Cancel queued repo work and release the pool before clones are deleted."""
+    global _repo_work_executor
+    executor, _repo_work_executor = _repo_work_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _cleanup_thread
-    _cleanup_thread = threading.Thread(target=_cleanup_loop, args=(_cleanup_stop,), daemon=True)
-    _cleanup_thread.start()
+    cleanup_task = asyncio.create_task(_cleanup_loop())
     yield
-    # Cleanup on shutdown: stop thread and delete all temp repos
-    _cleanup_stop.set()
+    # Cleanup on shutdown: stop the task and delete all temp repos
+    cleanup_task.cancel()
+    await asyncio.gather(cleanup_task, return_exceptions=True)
+    _shutdown_repo_work()
+    shutdown_metrics_pool()
     _cleanup_all_repos()
-    print("Shutdown: cleaned up all temp_clones")
+    logger.info("Shutdown: cleaned up all temp_clones")
 
 
 app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
@@ -103,23 +152,23 @@ class ChatRequest(BaseModel):
     message: str
 
 @app.get("/")
-def read_root():
+async def read_root() -> Dict[str, Any]:
     return {"status": "online", "service": "Code MRI Backend"}
 
 
 @app.post("/analyze")
-def analyze_repo(request: AnalyzeRequest):
+async def analyze_repo(request: AnalyzeRequest) -> Dict[str, Any]:
     """
     Clones a repository and returns its directory structure.
     """
     try:
         # 1. Clone
-        repo_path = clone_repository(request.url)
+        repo_path = await _run_repo_work(clone_repository, request.url)
         repo_id = os.path.basename(repo_path)
         _touch_repo(repo_id)
 
         # 2. Analyze
-        file_tree = analyze_directory_structure(repo_path)
+        file_tree = await _run_repo_work(analyze_directory_structure, repo_path)
 
         return {
             "message": "Analysis complete",
@@ -133,78 +182,91 @@ def analyze_repo(request: AnalyzeRequest):
 
 
 @app.get("/report/{repo_id}")
-def get_report(repo_id: str):
+async def get_report(repo_id: str) -> Dict[str, Any]:
     """
     Retrieve existing analysis for a repo (or re-analyze if simple).
     """
-    repo_path = os.path.join(settings.TEMP_DIR, repo_id)
-    if not os.path.exists(repo_path):
-        raise HTTPException(status_code=404, detail="Repository not found")
+    repo_path = _require_repo(repo_id)
 
-    _touch_repo(repo_id)
+    cached = _report_cache.get(repo_id)
+    if cached is not None:
+        return cached
 
     try:
-        file_tree = analyze_directory_structure(repo_path)
-        technologies = detect_technologies(repo_path)
-        metrics = calculate_aggregate_metrics(repo_path)
-        issues = run_static_analysis(repo_path)
-        summary = generate_summary(repo_path, technologies)
-        
-        return {
-            "repo_id": repo_id,
-            "tree": file_tree,
-            "technologies": technologies,
-            "metrics": metrics,
-            "issues": issues,
-            "summary": summary,
-        }
+        report = await _run_repo_work(_build_report, repo_path, repo_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # A delete or expiry may have run while the report was built; caching it
+    # then would leak the payload, since nothing would ever drop it again
+    if repo_id in repo_access_times and os.path.isdir(repo_path):
+        _report_cache[repo_id] = report
+    return report
+
+
+def _build_report(repo_path: str, repo_id: str) -> Dict[str, Any]:
+    # Static analysis reads every file on its own; run it alongside the
+    # metrics passes, which mostly wait on the analyzer's process pool.
+    # One walk of the source files is shared by every pass but the tree
+    files = walk_repo(repo_path)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        issues_future = executor.submit(run_static_analysis, repo_path, files)
+        # Aggregate metrics reuse the per-file metrics from the tree pass
+        metrics_by_path: Dict[str, Dict[str, Any]] = {}
+        file_tree = analyze_directory_structure(repo_path, metrics_by_path)
+        technologies = detect_technologies(repo_path, files)
+        metrics = calculate_aggregate_metrics(repo_path, metrics_by_path, files)
+        issues = issues_future.result()
+    summary = generate_summary(repo_path, technologies, files)
+    
+    return {
+        "repo_id": repo_id,
+        "tree": file_tree,
+        "technologies": technologies,
+        "metrics": metrics,
+        "issues": issues,
+        "summary": summary,
+    }
 
 
 @app.post("/index/{repo_id}")
-def index_repo_endpoint(repo_id: str):
+async def index_repo_endpoint(repo_id: str) -> Dict[str, Any]:
     """
     Trigger indexing for a cloned repo.
     """
-    repo_path = os.path.join(settings.TEMP_DIR, repo_id)
-    if not os.path.exists(repo_path):
-        raise HTTPException(status_code=404, detail="Repository not found")
-
-    _touch_repo(repo_id)
+    repo_path = _require_repo(repo_id)
 
     try:
-        result = index_repository(repo_path, repo_id)
+        result = await _run_repo_work(index_repository, repo_path, repo_id)
         return {"message": "Indexing complete", "result": result}
     except Exception as e:
-        print(f"Index Error: {e}")
+        logger.exception("Index error for repo %s", repo_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/chat")
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest) -> Dict[str, Any]:
     """
     Chat with the codebase.
     """
     _touch_repo(request.repo_id)
 
     try:
-        chain = get_chat_chain(request.repo_id)
-        response = chain.invoke(request.message)
+        response = await answer_question(request.repo_id, request.message)
         return {"response": response}
     except Exception as e:
-        print(f"Chat Error: {e}")
+        logger.exception("Chat error for repo %s", request.repo_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.delete("/repo/{repo_id}")
-def delete_repo(repo_id: str):
+async def delete_repo(repo_id: str) -> Dict[str, Any]:
     """
     Manually delete a cloned repo immediately.
     """
     repo_path = os.path.join(settings.TEMP_DIR, repo_id)
     if os.path.exists(repo_path):
-        shutil.rmtree(repo_path, ignore_errors=True)
-    with _cleanup_lock:
-        repo_access_times.pop(repo_id, None)
+        await _run_repo_work(partial(shutil.rmtree, repo_path, ignore_errors=True))
+    invalidate_repo_cache(repo_id)
+    _report_cache.pop(repo_id, None)
+    repo_access_times.pop(repo_id, None)
     return {"message": "Deleted"}